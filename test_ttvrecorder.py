@@ -0,0 +1,68 @@
+import json
+import unittest
+
+try:
+    import websocket
+
+    from ttvrecorder import Manager, TTVConfig
+except ImportError as e:
+    raise unittest.SkipTest(f"missing dependency: {e.name}")
+
+
+def frame(message_type: str, **payload) -> str:
+    return json.dumps({"metadata": {"message_type": message_type}, "payload": payload})
+
+
+def notification(event_type: str, login: str) -> str:
+    return frame(
+        "notification",
+        subscription={"type": event_type},
+        event={"broadcaster_user_login": login},
+    )
+
+
+class FakeWebSocket:
+    """Replays frames, recv() returns "" for a close frame like websocket-client."""
+
+    def __init__(self, frames):
+        self.frames = list(frames)
+
+    def recv(self):
+        if not self.frames:
+            raise websocket.WebSocketTimeoutException()
+        return self.frames.pop(0)
+
+    def settimeout(self, timeout):
+        pass
+
+
+class TestEventSubCloseFrame(unittest.TestCase):
+    def setUp(self):
+        self.manager = Manager([], TTVConfig("id", "secret", "token"))
+        self.updates = []
+        self.manager.update = lambda login, is_live: self.updates.append(
+            (login, is_live)
+        )
+        self.manager.retry_failed = lambda: None
+
+    def tearDown(self):
+        self.manager.close()
+
+    def test_drain_stops_on_close_frame(self):
+        ws = FakeWebSocket([notification("stream.offline", "foo"), ""])
+
+        self.manager.drain(ws)
+
+        self.assertEqual(self.updates, [("foo", False)])
+
+    def test_session_reconnects_on_close_frame(self):
+        ws = FakeWebSocket([notification("stream.online", "foo"), ""])
+
+        url = self.manager.eventsub_session(ws)
+
+        self.assertEqual(url, Manager.EVENTSUB_URL)
+        self.assertEqual(self.updates, [("foo", True)])
+
+
+if __name__ == "__main__":
+    unittest.main()
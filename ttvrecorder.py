@@ -1,17 +1,40 @@
 import argparse
+import ctypes
+import functools
+import json
 import logging
 import os
 import subprocess
 import threading
 import time
-from collections import deque
 from dataclasses import dataclass
 from datetime import datetime
 from enum import Enum
+from typing import Dict, List, Optional, Set
 
 import requests
 from streamlink import Streamlink
 
+try:
+    import av
+except ImportError:
+    av = None
+
+try:
+    import websocket
+except ImportError:
+    websocket = None
+
+# raw fallocate(2), unlike posix_fallocate glibc never emulates it by writing
+# blocks, and FALLOC_FL_KEEP_SIZE reserves space without growing the file
+FALLOC_FL_KEEP_SIZE = 0x01
+try:
+    _libc = ctypes.CDLL(None, use_errno=True)
+    fallocate = getattr(_libc, "fallocate64", None) or _libc.fallocate
+    fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+except (OSError, AttributeError):
+    fallocate = None
+
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s %(levelname)s %(module)s - %(funcName)s: %(message)s",
@@ -24,6 +47,8 @@ logger = logging.getLogger("ttv-recorder")
 class TTVConfig:
     client_id: str
     client_secret: str
+    # EventSub over WebSocket only accepts user access tokens
+    user_token: Optional[str] = None
 
     def __post_init__(self):
         assert self.client_id
@@ -31,16 +56,34 @@ class TTVConfig:
 
 
 class Recorder:
-    CHUNKSIZE = 4096
+    CHUNKSIZE = 65536
+    BUFSIZE = 1 << 20
+    PREALLOC = 256 << 20
+    # encoder and its default preset, fast enough to keep up with 1080p60 live
+    ENCODERS = {"hevc": ("libx265", "ultrafast"), "av1": ("libsvtav1", "12")}
 
     class State(Enum):
         INITIALIZING = 0
         RUNNING = 1
         STOPPED = 2
 
-    def __init__(self, channel: str, output_folder: str, quality: str):
+    def __init__(
+        self,
+        channel: str,
+        output_folder: str,
+        quality: str,
+        transcode: Optional[str] = None,
+        crf: int = 28,
+        preset: Optional[str] = None,
+    ):
+        assert transcode is None or transcode in Recorder.ENCODERS
+
         self.channel = channel
+        self.channel_url = f"https://twitch.tv/{channel}"
         self.quality = quality
+        self.transcode = transcode
+        self.crf = crf
+        self.preset = preset
 
         self.session = Streamlink()
         self.session.set_plugin_option("twitch", "twitch-disable-hosting", True)
@@ -48,8 +91,12 @@ class Recorder:
         self.session.set_plugin_option("twitch", "twitch-disable-reruns", True)
         self.session.set_plugin_option("twitch", "twitch-low-latency", True)
 
-        self.q = deque([])
+        # pre-allocated chunk, reused by readers that implement readinto
+        self.buf = bytearray(Recorder.CHUNKSIZE)
         self.stopper = threading.Event()
+        self.stopped = threading.Event()
+        # decides who processes the video, stop() or a session that ended itself
+        self.lock = threading.Lock()
 
         self.state = Recorder.State.INITIALIZING
 
@@ -60,49 +107,134 @@ class Recorder:
     def start(self):
         assert self.state in {Recorder.State.INITIALIZING, Recorder.State.STOPPED}
 
+        # reset both events before stop() can observe RUNNING
+        self.stopper.clear()
+        self.stopped.clear()
         self.state = Recorder.State.RUNNING
         self.get_new_filename()
-
-        fd = self.session.streams(f"https://twitch.tv/{self.channel}")[
-            self.quality
-        ].open()
-
-        def _writer(self):
-            with open(self.current_filename, "wb") as f:
-                while self.state == Recorder.State.RUNNING:
-                    sleep = 0.1
-                    if self.q:
-                        sleep = 0
-                        data = self.q.popleft()
-                        f.write(data)
-                    time.sleep(sleep)  # do not burn CPU on empty buffer
-
-        file_writer = threading.Thread(target=_writer, args=(self,))
-        file_writer.start()
-
-        while not self.stopper.is_set():
-            self.q.append(fd.read(Recorder.CHUNKSIZE))
-
-        self.state = Recorder.State.STOPPED
-
-    def stop(self, th: threading.Thread):
-        assert self.state == Recorder.State.RUNNING
-
-        self.stopper.set()
-
-        while not self.state == Recorder.State.STOPPED:
-            time.sleep(1)
-
-        th.join()
-
-        self.process_video()
-
-        self.stopper = threading.Event()
+        filename = self.current_filename
+
+        fd = encoder = None
+        opened = ended = False
+        try:
+            fd = self.session.streams(self.channel_url)[self.quality].open()
+
+            read = self.reader(fd)
+            is_stopped = self.stopper.is_set
+
+            if self.transcode:
+                codec, preset = Recorder.ENCODERS[self.transcode]
+                # encode from the pipe while recording, no second pass on disk
+                encoder = subprocess.Popen(
+                    [
+                        "/usr/bin/ffmpeg",
+                        "-n",
+                        "-i",
+                        "pipe:0",
+                        "-c:v",
+                        codec,
+                        "-preset",
+                        self.preset or preset,
+                        "-crf",
+                        str(self.crf),
+                        "-c:a",
+                        "copy",
+                        self.mkv_name,
+                    ],
+                    stdin=subprocess.PIPE,
+                    bufsize=Recorder.BUFSIZE,
+                )
+                out = encoder.stdin
+            else:
+                out = open(filename, "xb", buffering=Recorder.BUFSIZE)
+            opened = True
+
+            # reserve disk space ahead of the writes, released once done
+            prealloc = encoder is None and fallocate is not None
+
+            with out as f:
+                # hot loop, bound methods are hoisted out of it
+                write = f.write
+                pos = allocated = 0
+                try:
+                    while not is_stopped():
+                        data = read()
+                        if not data:
+                            # stream ended, end the session so it can be retried
+                            break
+                        write(data)
+                        pos += len(data)
+                        if prealloc and pos > allocated:
+                            prealloc = self.preallocate(f, allocated)
+                            allocated += Recorder.PREALLOC
+                finally:
+                    if allocated:
+                        # frees the unused reservation past the end of file
+                        f.truncate(pos)
+        except Exception:
+            logger.exception("%s: recording failed", self.channel)
+        finally:
+            if fd is not None:
+                # stops streamlink's worker threads and releases its connections
+                fd.close()
+            if encoder is not None:
+                # stdin is closed, wait for ffmpeg to flush the output and reap it
+                encoder.wait()
+            with self.lock:
+                # stop() was not called, the stream ended or failed on its own
+                ended = not self.stopper.is_set()
+                # never leave stop() waiting, even if the stream failed to open
+                self.state = Recorder.State.STOPPED
+                self.stopped.set()
+
+        if ended and opened:
+            # keep what was recorded, a restarted session writes a new file
+            logger.info("%s: recording ended, processing video", self.channel)
+            self.process_video(filename)
+
+    def stop(self):
+        with self.lock:
+            if self.state != Recorder.State.RUNNING:
+                # the session already ended and processes its own video
+                return
+            self.stopper.set()
+
+        # set by the worker once the output file is closed
+        self.stopped.wait()
+
+        self.process_video(self.current_filename)
+
+    @staticmethod
+    def preallocate(f, offset: int) -> bool:
+        if fallocate(f.fileno(), FALLOC_FL_KEEP_SIZE, offset, Recorder.PREALLOC):
+            # EOPNOTSUPP where the filesystem has no native fallocate
+            logger.warning(
+                "preallocation failed (%s), disabling it",
+                os.strerror(ctypes.get_errno()),
+            )
+            return False
+        return True
+
+    def reader(self, fd):
+        readinto = getattr(fd, "readinto", None)
+        if readinto is None:
+            # e.g. streamlink's HLS reader, write the returned bytes as they are
+            return functools.partial(fd.read, Recorder.CHUNKSIZE)
+
+        # fill the pre-allocated chunk, no allocation per read
+        buf = self.buf
+        view = memoryview(buf)
+        return lambda: view[: readinto(buf)]
 
     def get_new_filename(self):
-        dt = datetime.now().strftime("%d-%m-%Y_%H-%M")
-        filename = f"{self.channel}_{dt}.tmp"
-        self.current_filename = os.path.join(self.output_folder, filename)
+        # seconds and a counter keep a restarted session off the last file
+        dt = datetime.now().strftime("%d-%m-%Y_%H-%M-%S")
+        base = stem = os.path.join(self.output_folder, f"{self.channel}_{dt}")
+        n = 1
+        while any(os.path.exists(stem + ext) for ext in (".tmp", ".mp4", ".mkv")):
+            stem = f"{base}_{n}"
+            n += 1
+        self.current_filename = f"{stem}.tmp"
 
     def prepare_output_folder(self, output_folder):
         if not os.path.exists(output_folder):
@@ -110,10 +242,13 @@ class Recorder:
         self.output_folder = output_folder
 
     @property
-    def thumbnail_name(self):
-        return self.current_filename.replace(".tmp", ".jpg")
+    def mkv_name(self):
+        return self.current_filename.replace(".tmp", ".mkv")
+
+    def process_video(self, filename: str):
+        mp4_name = filename.replace(".tmp", ".mp4")
+        mkv_name = filename.replace(".tmp", ".mkv")
 
-    def process_video(self):
         #  extract a frame and use it as thumbnail
         subprocess.run(
             [
@@ -121,110 +256,410 @@ class Recorder:
                 "-ss",
                 "00:01:00",
                 "-i",
-                self.current_filename,
+                mkv_name if self.transcode else filename,
                 "-vframes",
                 "1",
-                self.thumbnail_name,
+                filename.replace(".tmp", ".jpg"),
             ]
         )
 
-        #  mpeg2-ts -> mp4, h.264/aac, moov atom at the start
-        p = subprocess.run(
-            [
-                "/usr/bin/ffmpeg",
-                "-i",
-                self.current_filename,
-                "-vcodec",
-                "copy",
-                "-acodec",
-                "copy",
-                "-movflags",
-                "faststart",
-                self.current_filename.replace(".tmp", ".mp4"),
-            ]
-        )
+        if self.transcode:
+            # already encoded into its final container while recording
+            return
 
-        if p.returncode == 0:
+        #  mpeg2-ts -> mp4, h.264/aac, moov atom at the start
+        ok = av is not None and self.remux(filename, mp4_name)
+        if not ok:
+            p = subprocess.run(
+                [
+                    "/usr/bin/ffmpeg",
+                    "-i",
+                    filename,
+                    "-vcodec",
+                    "copy",
+                    "-acodec",
+                    "copy",
+                    "-movflags",
+                    "faststart",
+                    mp4_name,
+                ]
+            )
+            ok = p.returncode == 0
+
+        if ok:
             # remove temp file
-            os.remove(self.current_filename)
+            os.remove(filename)
+
+    def remux(self, filename: str, mp4_name: str) -> bool:
+        #  copy packets into the new container in-process, no re-encoding
+        try:
+            with av.open(filename) as src, av.open(
+                mp4_name, "w", options={"movflags": "faststart"}
+            ) as dst:
+                out_streams = {
+                    s.index: dst.add_stream_from_template(s)
+                    for s in src.streams
+                    if s.type in {"video", "audio"}
+                }
+                for packet in src.demux():
+                    if packet.dts is None or packet.stream.index not in out_streams:
+                        continue
+                    packet.stream = out_streams[packet.stream.index]
+                    dst.mux(packet)
+        except Exception:
+            # e.g. non-monotonic DTS, which the ffmpeg cli repairs, or an old PyAV
+            logger.exception("remux failed, falling back to ffmpeg")
+            if os.path.exists(mp4_name):
+                os.remove(mp4_name)
+            return False
+        return True
 
 
 class Manager:
     POLL_INTERVAL = 30
-
-    def __init__(self, recorder: Recorder, ttv_config: TTVConfig):
-        self.recorder = recorder
+    RETRY_INTERVAL = 10
+    # helix accepts up to 100 logins per request
+    MAX_LOGINS = 100
+    AUTH_URL = "https://id.twitch.tv/oauth2/token"
+    STREAMS_URL = "https://api.twitch.tv/helix/streams"
+    USERS_URL = "https://api.twitch.tv/helix/users"
+    SUBSCRIPTIONS_URL = "https://api.twitch.tv/helix/eventsub/subscriptions"
+    EVENTSUB_URL = "wss://eventsub.wss.twitch.tv/ws"
+
+    def __init__(self, recorders: List[Recorder], ttv_config: TTVConfig):
+        # helix returns lowercase logins
+        self.recorders = {r.channel.lower(): r for r in recorders}
         self.ttv_config = ttv_config
 
         self.token = None
-        self.worker = None
-
-    @property
-    def channel(self) -> str:
-        return self.recorder.channel
+        # the level is set once at import, skip the per-poll debug calls
+        self.debug = logger.isEnabledFor(logging.DEBUG)
+        # stop() blocks while the video is processed, keep it off the poll loop
+        self.stoppers: Dict[str, threading.Thread] = {}
+        # eventsub only, channels known to be live and when failed ones were retried
+        self.online: Set[str] = set()
+        self.last_retry = 0.0
+
+        # built once, the session encodes them on each request
+        self.auth_data = {
+            "client_id": ttv_config.client_id,
+            "client_secret": ttv_config.client_secret,
+            "grant_type": "client_credentials",
+        }
+        self.streams_params = [
+            [("first", Manager.MAX_LOGINS)]
+            + [("user_login", login) for login in batch]
+            for batch in self.batches()
+        ]
+        # rebuilt in auth() whenever the token changes
+        self.headers = {"Client-ID": ttv_config.client_id}
+        self.user_headers = {
+            "Client-ID": ttv_config.client_id,
+            "Authorization": f"Bearer {ttv_config.user_token}",
+        }
+
+        # keep-alive session, TCP/TLS connections are reused across polls
+        self.http = requests.Session()
+
+    def batches(self) -> List[List[str]]:
+        logins = list(self.recorders)
+        return [
+            logins[i : i + Manager.MAX_LOGINS]
+            for i in range(0, len(logins), Manager.MAX_LOGINS)
+        ]
 
     def auth(self):
         logger.info("renewing token")
-        resp = requests.post(
-            f"https://id.twitch.tv/oauth2/token?client_id={self.ttv_config.client_id}&client_secret={self.ttv_config.client_secret}&grant_type=client_credentials"
-        )
+        resp = self.http.post(Manager.AUTH_URL, data=self.auth_data)
         self.token = resp.json()["access_token"]
+        self.headers = {
+            "Client-ID": self.ttv_config.client_id,
+            "Authorization": f"Bearer {self.token}",
+        }
+
+    def live_channels(self) -> Set[str]:
+        live = set()
+        for params in self.streams_params:
+            # retry once with a fresh token, a second 401 means bad credentials
+            for _ in range(2):
+                resp = self.http.get(
+                    Manager.STREAMS_URL, params=params, headers=self.headers
+                )
+                if resp.status_code != 401:
+                    break
+                self.auth()
+            else:
+                raise AuthError()
+
+            # one entry per live channel, offline ones are omitted
+            live.update(stream["user_login"] for stream in resp.json()["data"])
+        return live
+
+    def is_stopping(self, login: str) -> bool:
+        stopper = self.stoppers.get(login)
+        return stopper is not None and stopper.is_alive()
+
+    def stop(self, login: str):
+        self.stoppers[login] = threading.Thread(target=self.recorders[login].stop)
+        self.stoppers[login].start()
+
+    def update(self, login: str, is_live: bool):
+        recorder = self.recorders[login]
+
+        if self.is_stopping(login):
+            # do nothing, the last recording is still being processed
+            if self.debug:
+                logger.debug("%s: processing video...", login)
+        elif recorder.state in {
+            Recorder.State.INITIALIZING,
+            Recorder.State.STOPPED,
+        }:
+            if is_live:
+                # the Recorder is not running, start worker thread
+                logger.info("%s: starting worker thread", login)
+                threading.Thread(target=recorder.start).start()
+            else:
+                # do nothing, wait for channel to go live before initializing the Recorder
+                if self.debug:
+                    logger.debug("%s: channel is off, waiting...", login)
+        else:
+            assert recorder.state == Recorder.State.RUNNING
+            if is_live:
+                # do nothing, continue recording
+                if self.debug:
+                    logger.debug("%s: still recording...", login)
+            else:
+                # stop the recording
+                logger.info("%s: channel went off, stopping the recorder", login)
+                self.stop(login)
 
-    def is_channel_live(self) -> bool:
-        resp = requests.get(
-            f"https://api.twitch.tv/helix/search/channels?query={self.channel}",
-            headers={
-                "Client-ID": self.ttv_config.client_id,
-                "Authorization": f"Bearer {self.token}",
-            },
-        )
-
-        if resp.status_code == 401:
-            self.auth()
-            return self.is_channel_live()
-
-        for channel in resp.json()["data"]:
-            if channel["display_name"].lower() == self.channel:
-                return channel["is_live"]
-
-        raise ChannelNotFound()
+    def update_all(self, live: Set[str]):
+        for login in self.recorders:
+            self.update(login, login in live)
 
     def run(self):
         while True:
-            is_live = self.is_channel_live()
-
-            if self.recorder.state in {
-                Recorder.State.INITIALIZING,
-                Recorder.State.STOPPED,
-            }:
-                if is_live:
-                    # the Recorder is not running, start worker thread
-                    logger.info("starting worker thread")
-                    self.worker = threading.Thread(target=self.recorder.start)
-                    self.worker.start()
-                else:
-                    # do nothing, wait for channel to go live before initializing the Recorder
-                    logger.debug("channel is off, waiting...")
+            self.update_all(self.live_channels())
+            time.sleep(Manager.POLL_INTERVAL)
+
+    def get_broadcaster_ids(self) -> Dict[str, str]:
+        ids = {}
+        for batch in self.batches():
+            resp = self.http.get(
+                Manager.USERS_URL,
+                params=[("login", login) for login in batch],
+                headers=self.user_headers,
+            )
+            resp.raise_for_status()
+            ids.update({user["id"]: user["login"] for user in resp.json()["data"]})
+
+        missing = set(self.recorders) - set(ids.values())
+        if missing:
+            raise ChannelNotFound(", ".join(sorted(missing)))
+        return ids
+
+    def subscribe(self, session_id: str, broadcaster_ids: Dict[str, str]):
+        for broadcaster_id, login in broadcaster_ids.items():
+            for event_type in ("stream.online", "stream.offline"):
+                resp = self.http.post(
+                    Manager.SUBSCRIPTIONS_URL,
+                    headers=self.user_headers,
+                    json={
+                        "type": event_type,
+                        "version": "1",
+                        "condition": {"broadcaster_user_id": broadcaster_id},
+                        "transport": {"method": "websocket", "session_id": session_id},
+                    },
+                )
+                resp.raise_for_status()
+                logger.info("%s: subscribed to %s", login, event_type)
+
+    def run_eventsub(self):
+        assert websocket is not None, "eventsub requires websocket-client"
+        assert self.ttv_config.user_token, "eventsub requires a user access token"
+
+        try:
+            self.eventsub()
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code != 401:
+                raise
+            # user tokens expire and cannot be renewed from client credentials,
+            # keep the recordings going with the app token instead
+            logger.error("user access token rejected, falling back to polling")
+        self.run()
+
+    def eventsub(self):
+        broadcaster_ids = self.get_broadcaster_ids()
+        ws = self.reopen(broadcaster_ids)
+
+        try:
+            while True:
+                try:
+                    url = self.eventsub_session(ws)
+                except (OSError, websocket.WebSocketException):
+                    logger.warning("eventsub connection lost, reconnecting")
+                    url = Manager.EVENTSUB_URL
+
+                if url != Manager.EVENTSUB_URL:
+                    # keep the old connection until the new one is welcomed
+                    try:
+                        new_ws, _ = self.connect(url)
+                    except (OSError, websocket.WebSocketException):
+                        logger.warning(
+                            "eventsub reconnect failed, opening a new session"
+                        )
+                    else:
+                        self.drain(ws)
+                        ws.close()
+                        ws = new_ws
+                        continue
+
+                ws.close()
+                ws = self.reopen(broadcaster_ids)
+        finally:
+            ws.close()
+
+    def connect(self, url: str):
+        ws = websocket.create_connection(url)
+        message = self.receive(ws)
+        if message is None:
+            raise websocket.WebSocketConnectionClosedException()
+        assert message["metadata"]["message_type"] == "session_welcome"
+
+        session = message["payload"]["session"]
+        # give up if nothing arrives within the keepalive window
+        ws.settimeout(session["keepalive_timeout_seconds"] + 5)
+        return ws, session["id"]
+
+    def open_session(self, broadcaster_ids: Dict[str, str]):
+        ws, session_id = self.connect(Manager.EVENTSUB_URL)
+        try:
+            # new session, subscriptions are not carried over
+            self.subscribe(session_id, broadcaster_ids)
+            # catch up on anything missed while disconnected
+            self.online = self.live_channels()
+        except BaseException:
+            ws.close()
+            raise
+        self.update_all(self.online)
+        return ws
+
+    def reopen(self, broadcaster_ids: Dict[str, str]):
+        # ride out network errors, only a rejected token leaves eventsub mode
+        delay = 1
+        while True:
+            try:
+                return self.open_session(broadcaster_ids)
+            except (OSError, websocket.WebSocketException) as e:
+                # requests.HTTPError is an OSError too
+                response = getattr(e, "response", None)
+                if response is not None and response.status_code == 401:
+                    raise
+                logger.warning(
+                    "eventsub session failed (%s), retrying in %ds", e, delay
+                )
+            time.sleep(delay)
+            delay = min(delay * 2, Manager.POLL_INTERVAL)
+
+    def drain(self, ws):
+        # handle whatever the old connection delivered before the switch
+        ws.settimeout(1)
+        try:
+            while True:
+                message = self.receive(ws)
+                if message is None:
+                    break
+                self.handle(message)
+        except (
+            websocket.WebSocketTimeoutException,
+            websocket.WebSocketConnectionClosedException,
+        ):
+            pass
+
+    def eventsub_session(self, ws) -> str:
+        # returns the url to connect to next, see session_reconnect
+        while True:
+            message = self.receive(ws)
+            if message is None:
+                logger.warning("eventsub connection closed by twitch, reconnecting")
+                return Manager.EVENTSUB_URL
+            url = self.handle(message)
+            if url is not None:
+                return url
+            # keepalives arrive every few seconds while the socket is idle
+            self.retry_failed()
+
+    @staticmethod
+    def receive(ws) -> Optional[dict]:
+        # recv() returns an empty string on a close frame instead of raising
+        raw = ws.recv()
+        return json.loads(raw) if raw else None
+
+    def retry_failed(self):
+        # no new event comes for a recording that died while the channel is live
+        now = time.monotonic()
+        if now - self.last_retry < Manager.RETRY_INTERVAL:
+            return
+        self.last_retry = now
+
+        for login in self.online:
+            recorder = self.recorders[login]
+            if recorder.state == Recorder.State.STOPPED and not self.is_stopping(login):
+                logger.warning("%s: recording ended while live, restarting", login)
+                self.update(login, True)
+
+    def handle(self, message: dict) -> Optional[str]:
+        message_type = message["metadata"]["message_type"]
+        payload = message["payload"]
+
+        if message_type == "session_reconnect":
+            # subscriptions move to the new session, no need to resubscribe
+            return payload["session"]["reconnect_url"]
+        elif message_type == "notification":
+            event_type = payload["subscription"]["type"]
+            login = payload["event"]["broadcaster_user_login"]
+            logger.info("%s: received %s", login, event_type)
+            is_live = event_type == "stream.online"
+            if is_live:
+                self.online.add(login)
             else:
-                assert self.recorder.state == Recorder.State.RUNNING
-                if is_live:
-                    # do nothing, continue recording
-                    logger.debug("still recording...")
-                else:
-                    # stop the recording
-                    logger.info("channel went off, stopping the recorder")
-                    self.recorder.stop(self.worker)
+                self.online.discard(login)
+            self.update(login, is_live)
+        elif message_type == "revocation":
+            logger.warning("subscription %s revoked", payload["subscription"]["type"])
+            return Manager.EVENTSUB_URL
+        return None
 
-            time.sleep(Manager.POLL_INTERVAL)
+    def shutdown(self):
+        for login, recorder in self.recorders.items():
+            if recorder.state == Recorder.State.RUNNING and not self.is_stopping(login):
+                self.stop(login)
+        # wait for every recording to be processed
+        for stopper in self.stoppers.values():
+            stopper.join()
+
+    def close(self):
+        self.http.close()
 
 
 class ChannelNotFound(Exception):
     pass
 
 
+class AuthError(Exception):
+    pass
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("-c", "--channel", type=str, help="channel name")
+    parser.add_argument(
+        "-c",
+        "--channel",
+        type=str,
+        nargs="+",
+        required=True,
+        help="one or more channel names",
+    )
     parser.add_argument("-o", "--output-folder", type=str, help="output folder")
     parser.add_argument(
         "-q",
@@ -233,6 +668,27 @@ if __name__ == "__main__":
         help="recording quality, default=best",
         default="best",
     )
+    parser.add_argument(
+        "-t",
+        "--transcode",
+        type=str,
+        choices=sorted(Recorder.ENCODERS),
+        help="re-encode to hevc or av1 while recording, default=copy",
+        default=None,
+    )
+    parser.add_argument(
+        "--crf",
+        type=int,
+        help="constant rate factor used with --transcode, default=28",
+        default=28,
+    )
+    parser.add_argument(
+        "--preset",
+        type=str,
+        help="encoder preset used with --transcode, "
+        "default=ultrafast (hevc) or 12 (av1) to keep up in real time",
+        default=None,
+    )
     parser.add_argument(
         "-tci",
         "--ttv-client-id",
@@ -247,19 +703,46 @@ if __name__ == "__main__":
         help="twitch client secret",
         default=os.environ.get("TTV_CLIENT_SECRET"),
     )
+    parser.add_argument(
+        "-tut",
+        "--ttv-user-token",
+        type=str,
+        help="twitch user access token, required by --eventsub",
+        default=os.environ.get("TTV_USER_TOKEN"),
+    )
+    parser.add_argument(
+        "--eventsub",
+        action="store_true",
+        help="wait for stream.online/offline events instead of polling",
+    )
     args = parser.parse_args()
 
     ttv_config = TTVConfig(
-        client_id=args.ttv_client_id, client_secret=args.ttv_client_secret
-    )
-    rec = Recorder(
-        channel=args.channel, output_folder=args.output_folder, quality=args.quality
+        client_id=args.ttv_client_id,
+        client_secret=args.ttv_client_secret,
+        user_token=args.ttv_user_token,
     )
-    manager = Manager(recorder=rec, ttv_config=ttv_config)
+    recorders = [
+        Recorder(
+            channel=channel,
+            output_folder=args.output_folder,
+            quality=args.quality,
+            transcode=args.transcode,
+            crf=args.crf,
+            preset=args.preset,
+        )
+        # twitch logins are case-insensitive, record each channel once
+        for channel in dict.fromkeys(c.lower() for c in args.channel)
+    ]
+    manager = Manager(recorders=recorders, ttv_config=ttv_config)
 
     try:
-        manager.run()
+        if args.eventsub:
+            manager.run_eventsub()
+        else:
+            manager.run()
     except KeyboardInterrupt:
         logger.info("shutting down...")
-        if manager.recorder.state == Recorder.State.RUNNING:
-            manager.recorder.stop(manager.worker)
+        manager.shutdown()
+    finally:
+        manager.close()